@@ -1,171 +1,370 @@
 from prefect import flow, task
 from prefect.tasks import task_input_hash
+from prefect.cache_policies import NO_CACHE
 from datetime import timedelta, date
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+import httpx
+import orjson
 import duckdb
-import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import asyncio
+import math
+import random
 import os
-from dotenv import load_dotenv
-from typing import Dict, List
 import re
+from dotenv import load_dotenv
+from typing import Dict, List, Tuple
 
 load_dotenv()
 
-API_RATE_LIMIT_DELAY = 0.15
-BATCH_SIZE = 500
-
-def clean_string(s: str) -> str: # cleaning string for deduplication
-    if not s:
-        return ""
-    s = re.sub(r'[^\w\s]', '', s.lower())
-    s = re.sub(r'\s+', ' ', s).strip()
-    return s
-
-def get_spotify_client():
-    return spotipy.Spotify(
-        client_credentials_manager=SpotifyClientCredentials(
-            client_id=os.getenv('SPOTIFY_CLIENT_ID'),
-            client_secret=os.getenv('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_API_URL = 'https://api.spotify.com/v1'
+SPOTIFY_TOKEN_URL = 'https://accounts.spotify.com/api/token'
+
+API_RATE_LIMIT_DELAY = 0.15  # one request slot leaks back every 150ms (~6-7 req/s)
+MAX_CONCURRENT_REQUESTS = 8
+
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF_INITIAL = 0.5
+RETRY_BACKOFF_MAX = 30
+
+# only the track fields we store, spotify prunes the rest (available_markets etc.) server side
+PLAYLIST_TRACK_FIELDS = 'items(track(id,name,duration_ms,popularity,explicit,artists(name),album(name,release_date))),total'
+
+BATCH_SIZE = 10000  # duckdb bulk inserts get much faster with bigger batches
+
+# tracks outside this range are skipped on insert
+MIN_DURATION_MS = 30000
+MAX_DURATION_MS = 600000
+
+DB_PATH = 'data/processed/spotify.duckdb'
+DUCKDB_MEMORY_LIMIT = '4GB'
+
+# the flow creates the tables it writes to from the repo schema, so the two never drift apart
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'sql', 'create_schema.sql')
+FLOW_TABLES = ('playlists', 'tracks', 'playlist_tracks')
+
+# arrow uses RE2, whose \w and \s are ascii only, so spell out python's unicode classes.
+# python's \s also takes \v, the \x1c-\x1f separators and \x85, which RE2's \s and \p{Z} leave out
+_RE_NONWORD = r'[^\p{L}\p{N}_\s\x0b\x1c-\x1f\x85\p{Z}]'
+_RE_WS = r'[\s\x0b\x1c-\x1f\x85\p{Z}]+'
+
+def clean_strings(s: pa.ChunkedArray) -> pa.ChunkedArray: # cleaning a whole column for deduplication
+    s = pc.utf8_lower(pc.fill_null(s, ''))
+    s = pc.replace_substring_regex(s, _RE_NONWORD, '')
+    s = pc.replace_substring_regex(s, _RE_WS, ' ')
+    return pc.utf8_trim_whitespace(s)
+
+def backoff_delay(attempt: int) -> float: # exponential backoff with jitter
+    return min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_INITIAL * 2 ** (attempt - 1)) + random.uniform(0, RETRY_BACKOFF_INITIAL)
+
+class LeakyBucket: # global rate limiter shared by all concurrent requests
+    def __init__(self, leak_delay: float, capacity: int):
+        self.leak_delay = leak_delay
+        self._slots = asyncio.BoundedSemaphore(capacity)
+        self._leaker = None
+
+    async def __aenter__(self):
+        self._leaker = asyncio.create_task(self._leak())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._leaker.cancel()
+
+    async def _leak(self):
+        # requests take a slot and never give it back, this task frees one slot per tick
+        while True:
+            await asyncio.sleep(self.leak_delay)
+            try:
+                self._slots.release()
+            except ValueError:  # every slot is already free
+                pass
+
+    async def acquire(self):
+        await self._slots.acquire()
+
+class SpotifyAsync: # thin Web API client, one token and connection pool per flow run
+    def __init__(self):
+        self._session = httpx.AsyncClient(base_url=SPOTIFY_API_URL, timeout=30,
+                                          limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS))
+        self._bucket = LeakyBucket(API_RATE_LIMIT_DELAY, MAX_CONCURRENT_REQUESTS)
+        self._token_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        # __aexit__ doesn't run if this raises, so a failed token request closes the client itself
+        try:
+            self._session.headers['Authorization'] = f"Bearer {await self._get_access_token()}"
+        except BaseException:
+            await self._session.aclose()
+            raise
+        await self._bucket.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._bucket.__aexit__(*exc_info)
+        await self._session.aclose()
+
+    async def _get_access_token(self) -> str: # client credentials flow
+        response = await self._session.post(
+            SPOTIFY_TOKEN_URL,
+            data={'grant_type': 'client_credentials'},
+            auth=(os.getenv('SPOTIFY_CLIENT_ID'), os.getenv('SPOTIFY_CLIENT_SECRET'))
         )
-    )
+        response.raise_for_status()
+        return orjson.loads(response.content)['access_token']
 
-@task(retries=3, retry_delay_seconds=10) # search for playlists
-def search_playlists(query: str, limit: int = 50) -> List[Dict]:
-    sp = get_spotify_client()
-    time.sleep(API_RATE_LIMIT_DELAY)
-    
-    try:
-        results = sp.search(q=query, type='playlist', limit=limit)
-        playlists = []
-        
-        for p in results.get('playlists', {}).get('items', []):
-            if not p or not p.get('id'):
+    async def _refresh_token(self, expired_auth: str):
+        # tokens last an hour, the one client outlives that on long runs
+        async with self._token_lock:
+            if self._session.headers['Authorization'] == expired_auth:  # not already refreshed by another request
+                self._session.headers['Authorization'] = f"Bearer {await self._get_access_token()}"
+
+    async def get(self, path: str, params: Dict) -> Dict:
+        # retries live here rather than on the tasks, so a failed page doesn't redo the whole playlist
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            await self._bucket.acquire()
+            
+            try:
+                response = await self._session.get(path, params=params)
+            except httpx.TransportError as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                delay = backoff_delay(attempt)
+                print(f"Request failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            
+            if response.status_code == 401 and attempt < MAX_ATTEMPTS:
+                await self._refresh_token(response.request.headers['Authorization'])
+                continue
+            
+            if (response.status_code == 429 or response.status_code >= 500) and attempt < MAX_ATTEMPTS:
+                # rate limited, wait as long as spotify asks before trying again
+                if response.status_code == 429 and 'Retry-After' in response.headers:
+                    delay = float(response.headers['Retry-After'])
+                else:
+                    delay = backoff_delay(attempt)
+                print(f"Got {response.status_code}, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
                 continue
             
-            playlists.append({
-                'playlist_id': p['id'],
-                'playlist_name': p.get('name', 'Unknown'),
-                'owner': p.get('owner', {}).get('display_name', 'Unknown'),
-                'follower_count': p.get('followers', {}).get('total', 0),
-                'total_tracks': p.get('tracks', {}).get('total', 0),
-                'category': query
-            })
+            response.raise_for_status()
+            return orjson.loads(response.content)
+
+def cache_key_without_client(context, parameters) -> str: # the client can't be hashed and doesn't change results
+    return task_input_hash(context, {k: v for k, v in parameters.items() if k != 'api'})
+
+def playlist_snapshot_cache_key(context, parameters) -> str: # same snapshot_id means the same tracks
+    if parameters.get('snapshot_id') is None:
+        return None
+    return cache_key_without_client(context, parameters)
+
+# cached for an hour so a re-run after a failure skips the searches. the results carry snapshot_id,
+# which decides what gets refetched, so this has to stay well under the daily run cadence.
+# errors are raised rather than returned as [] so a failed search never gets cached
+@task(cache_key_fn=cache_key_without_client, cache_expiration=timedelta(hours=1))
+async def search_playlists(api: SpotifyAsync, query: str, limit: int = 50) -> List[Dict]:
+    results = await api.get('/search', {'q': query, 'type': 'playlist', 'limit': limit})
+    playlists = []
+    
+    for p in results.get('playlists', {}).get('items', []):
+        if not p or not p.get('id'):
+            continue
         
-        return playlists
-    except Exception as e:
-        print(f"Error searching '{query}': {e}")
-        return []
-
-@task(retries=3, retry_delay_seconds=10) # fetch tracks from playlists
-def fetch_playlist_tracks(playlist_id: str) -> List[Dict]:
-    sp = get_spotify_client()
+        playlists.append({
+            'playlist_id': p['id'],
+            'playlist_name': p.get('name', 'Unknown'),
+            'owner': p.get('owner', {}).get('display_name', 'Unknown'),
+            'follower_count': p.get('followers', {}).get('total', 0),
+            'total_tracks': p.get('tracks', {}).get('total', 0),
+            'category': query,
+            'snapshot_id': p.get('snapshot_id')
+        })
+    
+    return playlists
+
+# cached per playlist snapshot, so a re-run after a failed save doesn't hit the API again
+@task(cache_key_fn=playlist_snapshot_cache_key, cache_expiration=timedelta(days=1)) # fetch tracks from playlists
+async def fetch_playlist_tracks(api: SpotifyAsync, playlist_id: str, snapshot_id: str = None) -> List[Dict]:
     all_tracks = []
-    offset = 0
     limit = 100
+    path = f"/playlists/{playlist_id}/tracks"
     
-    while True:
-        time.sleep(API_RATE_LIMIT_DELAY)
+    # first page tells us the total, then every remaining page is requested at once.
+    # any page failing fails the whole playlist, so it is never saved half fetched
+    first_page = await api.get(path, {'fields': PLAYLIST_TRACK_FIELDS, 'limit': limit, 'offset': 0})
+    
+    offsets = [limit * n for n in range(1, math.ceil(first_page.get('total', 0) / limit))]
+    pages = await asyncio.gather(*[
+        api.get(path, {'fields': PLAYLIST_TRACK_FIELDS, 'limit': limit, 'offset': offset}) for offset in offsets
+    ])
+    
+    items = []
+    for page in [first_page, *pages]: # gather keeps offset order
+        items.extend(page.get('items', []))
+    
+    for item in items:
+        track = item.get('track')
+        if not track or not track.get('id'):
+            continue
         
-        try:
-            results = sp.playlist_tracks(playlist_id, limit=limit, offset=offset)
-            items = results.get('items', [])
-            
-            if not items:
-                break
-            
-            for item in items:
-                track = item.get('track')
-                if not track or not track.get('id'):
-                    continue
-                
-                # skip invalid durations
-                duration = track.get('duration_ms', 0)
-                if duration < 30000 or duration > 600000:
-                    continue
-                
-                artists = track.get('artists', [])
-                artist_name = artists[0].get('name', 'Unknown') if artists else 'Unknown'
-                
-                album = track.get('album', {})
-                release_date = album.get('release_date', '')
-                release_year = None
-                
-                if release_date and len(release_date) >= 4:
-                    try:
-                        release_year = int(release_date[:4])
-                    except:
-                        pass
-                
-                all_tracks.append({
-                    'track_id': track['id'],
-                    'track_name': track['name'],
-                    'track_name_clean': clean_string(track['name']),
-                    'artist_name': artist_name,
-                    'artist_name_clean': clean_string(artist_name),
-                    'album_name': album.get('name', 'Unknown'),
-                    'release_year': release_year,
-                    'duration_ms': duration,
-                    'popularity': track.get('popularity', 0),
-                    'explicit': track.get('explicit', False),
-                    'playlist_id': playlist_id
-                })
-            
-            offset += limit
-            
-            if len(items) < limit:
-                break
-                
-        except Exception as e:
-            print(f"Error fetching tracks: {e}")
-            break
+        artists = track.get('artists', [])
+        artist_name = artists[0].get('name', 'Unknown') if artists else 'Unknown'
+        
+        album = track.get('album', {})
+        
+        all_tracks.append({
+            'track_id': track['id'],
+            'track_name': track['name'],
+            'artist_name': artist_name,
+            'album_name': album.get('name', 'Unknown'),
+            'release_date': album.get('release_date', ''),  # year is parsed on insert
+            'duration_ms': track.get('duration_ms', 0),
+            'popularity': track.get('popularity', 0),
+            'explicit': track.get('explicit', False),
+            'playlist_id': playlist_id
+        })
     
     return all_tracks
 
-@task
-def save_to_duckdb(playlists: List[Dict], tracks: List[Dict]): # save data to DuckDB
-    conn = duckdb.connect('data/processed/spotify.duckdb')
+def load_table_ddl(path: str, tables: Tuple[str, ...]) -> str:
+    # only the CREATE TABLEs, the rest of the schema (indexes, stats tables) isn't the flow's to build
+    with open(path) as f:
+        statements = f.read().split(';')
+    
+    return ';'.join(
+        stmt for stmt in statements
+        if (m := re.search(r'CREATE TABLE IF NOT EXISTS (\w+) \(', stmt)) and m.group(1) in tables
+    )
+
+def connect_duckdb() -> duckdb.DuckDBPyConnection: # one connection for the whole flow
+    conn = duckdb.connect(DB_PATH)
+    conn.execute(f"PRAGMA threads={os.cpu_count() or 1}")
+    conn.execute(f"PRAGMA memory_limit='{DUCKDB_MEMORY_LIMIT}'")
+    conn.execute("PRAGMA preserve_insertion_order=false")  # nothing reads rows back in insert order
+    conn.execute(load_table_ddl(SCHEMA_PATH, FLOW_TABLES))
+    
+    # databases created before incremental sync don't have this column yet
+    conn.execute("ALTER TABLE playlists ADD COLUMN IF NOT EXISTS snapshot_id VARCHAR")
+    return conn
+
+def get_stored_snapshots(conn: duckdb.DuckDBPyConnection) -> Dict[str, str]: # latest snapshot_id per playlist
+    return dict(conn.execute("""
+        SELECT playlist_id, arg_max(snapshot_id, snapshot_date)
+        FROM playlists
+        GROUP BY playlist_id
+    """).fetchall())
+
+@task(cache_policy=NO_CACHE)
+def save_playlists(conn: duckdb.DuckDBPyConnection, playlists: List[Dict], snapshot_date: date): # save playlists to DuckDB
+    if not playlists:
+        return
+    
+    # last duplicate wins like the old row-by-row replace
+    playlists_batch = pa.Table.from_pylist(list({p['playlist_id']: p for p in playlists}.values()))
+    conn.register('playlists_batch', playlists_batch)
+    conn.execute("""
+        INSERT OR REPLACE INTO playlists 
+        (playlist_id, snapshot_date, playlist_name, owner, follower_count, 
+         total_tracks, category, snapshot_id, data_source)
+        SELECT playlist_id, ?, playlist_name, owner, follower_count,
+               total_tracks, category, snapshot_id, 'fast_collection'
+        FROM playlists_batch
+    """, [snapshot_date])
+    conn.unregister('playlists_batch')
+    conn.commit()
     
+    print(f"  ✓ Saved {len(playlists_batch)} playlists")
+
+@task(cache_policy=NO_CACHE)
+def carry_forward_tracks(conn: duckdb.DuckDBPyConnection, playlist_ids: List[str], snapshot_date: date) -> int:
+    # unchanged playlists aren't fetched, so their last synced tracks are copied into today's snapshot
+    if not playlist_ids:
+        return 0
+    
+    conn.register('skipped_batch', pa.table({'playlist_id': playlist_ids}))
+    new_entries = conn.execute("""
+        INSERT INTO playlist_tracks
+        (playlist_id, track_id, snapshot_date)
+        SELECT pt.playlist_id, pt.track_id, ?
+        FROM playlist_tracks pt
+        JOIN (
+            -- same snapshot get_stored_snapshots compared against
+            SELECT playlist_id, MAX(snapshot_date) AS snapshot_date
+            FROM playlists
+            WHERE snapshot_id IS NOT NULL AND playlist_id IN (SELECT playlist_id FROM skipped_batch)
+            GROUP BY playlist_id
+        ) latest USING (playlist_id, snapshot_date)
+        ON CONFLICT (playlist_id, track_id, snapshot_date) DO NOTHING
+    """, [snapshot_date]).fetchone()[0]
+    conn.unregister('skipped_batch')
+    conn.commit()
+    
+    print(f"  ✓ Carried forward {new_entries} entries for {len(playlist_ids)} unchanged playlists")
+    return new_entries
+
+def insert_tracks_batch(conn: duckdb.DuckDBPyConnection, tracks: List[Dict], edges: List[Tuple[str, str]],
+                        snapshot_date: date) -> Tuple[int, int]: # insert a batch of tracks into DuckDB
+    new_tracks, new_entries = 0, 0
+    
+    # tracks and their edges go in together, one transaction per batch
+    conn.begin()
     try:
-        # save playlists
-        if playlists:
-            conn.executemany("""
-                INSERT OR REPLACE INTO playlists 
-                (playlist_id, snapshot_date, playlist_name, owner, follower_count, 
-                 total_tracks, category, data_source)
-                VALUES (?, ?, ?, ?, ?, ?, ?, 'fast_collection')
-            """, [(p['playlist_id'], date.today(), p['playlist_name'], p['owner'],
-                   p['follower_count'], p['total_tracks'], p['category']) for p in playlists])
-        
-        # save tracks
         if tracks:
-            conn.executemany("""
-                INSERT OR IGNORE INTO tracks 
+            tracks_batch = pa.Table.from_pylist(tracks)
+            tracks_batch = tracks_batch.append_column('track_name_clean', clean_strings(tracks_batch['track_name']))
+            tracks_batch = tracks_batch.append_column('artist_name_clean', clean_strings(tracks_batch['artist_name']))
+            
+            conn.register('tracks_batch', tracks_batch)
+            new_tracks = conn.execute("""
+                INSERT INTO tracks 
                 (track_id, track_name, track_name_clean, artist_name, artist_name_clean,
                  album_name, release_year, duration_ms, popularity, explicit)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, [(t['track_id'], t['track_name'], t['track_name_clean'],
-                   t['artist_name'], t['artist_name_clean'], t['album_name'],
-                   t['release_year'], t['duration_ms'], t['popularity'], 
-                   t['explicit']) for t in tracks])
-            
-            # save playlist-track relationships
-            conn.executemany("""
-                INSERT OR IGNORE INTO playlist_tracks 
+                SELECT track_id, track_name, track_name_clean, artist_name, artist_name_clean, album_name,
+                       -- dates come as '2013', '2013-05' or '2013-05-15', malformed ones become NULL
+                       CASE WHEN length(release_date) >= 4 THEN TRY_CAST(left(release_date, 4) AS SMALLINT) END,
+                       duration_ms, popularity, explicit
+                FROM tracks_batch
+                WHERE duration_ms BETWEEN ? AND ?
+                ON CONFLICT (track_id) DO NOTHING
+            """, [MIN_DURATION_MS, MAX_DURATION_MS]).fetchone()[0]
+            conn.unregister('tracks_batch')
+        
+        # save playlist-track relationships. tracks sent in earlier batches aren't repeated,
+        # so edges are checked against the tracks table, which only holds valid durations
+        if edges:
+            playlist_ids, track_ids = zip(*edges)
+            conn.register('edges_batch', pa.table({'playlist_id': playlist_ids, 'track_id': track_ids}))
+            new_entries = conn.execute("""
+                INSERT INTO playlist_tracks 
                 (playlist_id, track_id, snapshot_date)
-                VALUES (?, ?, ?)
-            """, [(t['playlist_id'], t['track_id'], date.today()) for t in tracks])
+                SELECT e.playlist_id, e.track_id, ?
+                FROM edges_batch e
+                JOIN tracks t USING (track_id)
+                ON CONFLICT (playlist_id, track_id, snapshot_date) DO NOTHING
+            """, [snapshot_date]).fetchone()[0]
+            conn.unregister('edges_batch')
         
         conn.commit()
-        
-        unique = len(set([t['track_id'] for t in tracks]))
-        print(f"  ✓ Saved {len(tracks)} entries ({unique} unique tracks)")
-        
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    # counts come from the inserts, so tracks and edges dropped by the duration filter aren't included
+    print(f"  ✓ Saved {new_entries} entries ({new_tracks} new tracks)")
+    
+    # rows actually inserted, so the flow can keep running totals without counting tables
+    return new_tracks, new_entries
+
+@task(cache_policy=NO_CACHE)
+async def save_tracks_batch(conn: duckdb.DuckDBPyConnection, tracks: List[Dict], edges: List[Tuple[str, str]],
+                            snapshot_date: date) -> Tuple[int, int]: # save a batch of tracks to DuckDB
+    # the insert runs in a worker thread so in-flight playlist fetches keep going meanwhile.
+    # connections aren't thread safe, so the thread gets its own cursor on the shared database
+    with conn.cursor() as cursor:
+        return await asyncio.to_thread(insert_tracks_batch, cursor, tracks, edges, snapshot_date)
 
 @flow(name="Playlist Collection", log_prints=True) 
-def playlist_collect():
+async def playlist_collect():
     # focusing search queries
     queries = [
         'workout', 'gym', 'fitness', 'running', 'cardio',
@@ -176,55 +375,115 @@ def playlist_collect():
     
     print(f"Collecting from {len(queries)} search queries...")
     
+    conn = connect_duckdb()
+    snapshot_date = date.today()  # one snapshot per run, even if it crosses midnight
     all_playlists = []
-    all_tracks = []
-    
-    # collecting playlists
-    for query in queries:
-        print(f"\nSearching: {query}")
-        playlists = search_playlists(query, limit=50)
-        all_playlists.extend(playlists)
+    unique_playlists = []
+    seen_playlist_ids = set()
+    # popular songs repeat across playlists, so each track is only sent once per run plus every edge
+    seen_track_ids = set()
+    batch_tracks: List[Dict] = []
+    edges: List[Tuple[str, str]] = []
+    failed_playlist_ids = set()
+    total_unique, total_entries = 0, 0
     
-    # unique playlists only
-    unique_playlists = {p['playlist_id']: p for p in all_playlists}.values()
-    unique_playlists = list(unique_playlists)[:200]  # limiting to 200 playlists for manageability
-    
-    print(f"\nFound {len(unique_playlists)} unique playlists")
-    print(f"\nFetching tracks, please wait!\n")
-    
-    # fetch tracks
-    for i, playlist in enumerate(unique_playlists, 1):
-        print(f"[{i}/{len(unique_playlists)}] {playlist['playlist_name'][:50]}...")
+    try:
+        async with SpotifyAsync() as api:
+            # collecting playlists, every query at once under the shared rate limit
+            search_results = await asyncio.gather(*[
+                search_playlists(api, query, limit=50) for query in queries
+            ], return_exceptions=True)
+            
+            for query, playlists in zip(queries, search_results): # gather keeps query order
+                if isinstance(playlists, Exception):
+                    print(f"Error searching '{query}': {playlists}")
+                    continue
+                print(f"Searched: {query} ({len(playlists)} playlists)")
+                all_playlists.extend(playlists)
+                
+                # unique playlists only
+                for p in playlists:
+                    if p['playlist_id'] not in seen_playlist_ids:
+                        seen_playlist_ids.add(p['playlist_id'])
+                        unique_playlists.append(p)
+            
+            unique_playlists = unique_playlists[:200]  # limiting to 200 playlists for manageability
+            
+            print(f"\nFound {len(unique_playlists)} unique playlists")
+            
+            # incremental sync, only fetch tracks for playlists that changed since the last run
+            stored_snapshots = get_stored_snapshots(conn)
+            changed_playlists = [
+                p for p in unique_playlists
+                if p['snapshot_id'] is None or stored_snapshots.get(p['playlist_id']) != p['snapshot_id']
+            ]
+            
+            print(f"Skipping {len(unique_playlists) - len(changed_playlists)} unchanged playlists")
+            print(f"\nFetching tracks, please wait!\n")
+            
+            # fetch tracks, all playlists at once under the shared rate limit
+            async def fetch_changed(playlist: Dict):
+                try:
+                    return playlist, await fetch_playlist_tracks(api, playlist['playlist_id'], playlist['snapshot_id'])
+                except Exception as e:
+                    print(f"Error fetching tracks for '{playlist['playlist_name'][:50]}': {e}")
+                    return playlist, None
+            
+            # save each batch as soon as it fills up rather than holding every track in memory
+            fetches = asyncio.as_completed([fetch_changed(p) for p in changed_playlists])
+            for i, fetch in enumerate(fetches, 1):
+                playlist, tracks = await fetch
+                
+                if tracks is None:
+                    failed_playlist_ids.add(playlist['playlist_id'])
+                else:
+                    print(f"[{i}/{len(changed_playlists)}] {playlist['playlist_name'][:50]} ({len(tracks)} tracks)")
+                    for t in tracks:
+                        if t['track_id'] not in seen_track_ids:
+                            seen_track_ids.add(t['track_id'])
+                            batch_tracks.append(t)
+                        edges.append((t['playlist_id'], t['track_id']))
+                
+                # saving in batches
+                if len(edges) >= BATCH_SIZE:
+                    unique_count, entries_count = await save_tracks_batch(conn, batch_tracks, edges, snapshot_date)
+                    total_unique += unique_count
+                    total_entries += entries_count
+                    batch_tracks, edges = [], []
+                
+                # progress update
+                if i % 25 == 0:
+                    print(f"\n  Progress: {total_unique:,} new tracks, {total_entries:,} new entries saved\n")
         
-        tracks = fetch_playlist_tracks(playlist['playlist_id'])
-        all_tracks.extend(tracks)
+        # save remaining tracks
+        if edges:
+            unique_count, entries_count = await save_tracks_batch(conn, batch_tracks, edges, snapshot_date)
+            total_unique += unique_count
+            total_entries += entries_count
         
-        # saving in batches
-        if len(all_tracks) >= BATCH_SIZE:
-            save_to_duckdb(all_playlists, all_tracks)
-            all_tracks = []
+        # every playlist in today's snapshot gets its tracks, fetched or not
+        changed_ids = {p['playlist_id'] for p in changed_playlists}
+        total_entries += carry_forward_tracks(conn, [
+            p['playlist_id'] for p in unique_playlists if p['playlist_id'] not in changed_ids
+        ], snapshot_date)
         
-        # progress update
-        if i % 25 == 0:
-            conn = duckdb.connect('data/processed/spotify.duckdb')
-            total = conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
-            entries = conn.execute("SELECT COUNT(*) FROM playlist_tracks").fetchone()[0]
-            conn.close()
-            print(f"\n  Progress: {total:,} unique tracks, {entries:,} total entries\n")
-    
-    # save remaining tracks
-    if all_tracks:
-        save_to_duckdb(all_playlists, all_tracks)
-    
-    # final stats
-    conn = duckdb.connect('data/processed/spotify.duckdb')
-    stats = {
-        'playlists': conn.execute("SELECT COUNT(DISTINCT playlist_id) FROM playlists").fetchone()[0],
-        'tracks': conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0],
-        'entries': conn.execute("SELECT COUNT(*) FROM playlist_tracks").fetchone()[0],
-        'artists': conn.execute("SELECT COUNT(DISTINCT artist_name) FROM tracks").fetchone()[0]
-    }
-    conn.close()
+        # playlists are saved once, after their tracks. only playlists whose tracks are stored keep
+        # their snapshot_id, so ones past the limit or that failed get fetched on a later run
+        synced_ids = {p['playlist_id'] for p in unique_playlists} - failed_playlist_ids
+        save_playlists(conn, [
+            {**p, 'snapshot_id': p['snapshot_id'] if p['playlist_id'] in synced_ids else None}
+            for p in all_playlists
+        ], snapshot_date)
+        
+        # final stats
+        stats = {
+            'playlists': conn.execute("SELECT COUNT(DISTINCT playlist_id) FROM playlists").fetchone()[0],
+            'tracks': conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0],
+            'entries': conn.execute("SELECT COUNT(*) FROM playlist_tracks").fetchone()[0],
+            'artists': conn.execute("SELECT COUNT(DISTINCT artist_name) FROM tracks").fetchone()[0]
+        }
+    finally:
+        conn.close()
     
     print("Collection is complete!")
     print(f"Unique tracks: {stats['tracks']:,}")
@@ -233,4 +492,4 @@ def playlist_collect():
     print(f"Unique artists: {stats['artists']:,}")
 
 if __name__ == "__main__":
-    playlist_collect()
\ No newline at end of file
+    asyncio.run(playlist_collect())
\ No newline at end of file
@@ -1,4 +1,4 @@
--- Core Tables (for documentation purposes)
+-- Core Tables (spotify_ingestion.py creates these three from this file)
 
 -- playlists
 CREATE TABLE IF NOT EXISTS playlists (
@@ -14,6 +14,7 @@ CREATE TABLE IF NOT EXISTS playlists (
     category VARCHAR,
     search_query VARCHAR,
     data_source VARCHAR,  -- 'search', 'category', 'featured'
+    snapshot_id VARCHAR,  -- spotify's version id, unchanged playlists are skipped on re-runs
     ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (playlist_id, snapshot_date)
 );
@@ -31,9 +32,9 @@ CREATE TABLE IF NOT EXISTS tracks (
     album_name VARCHAR,
     album_type VARCHAR,
     release_date DATE,
-    release_year INTEGER,
+    release_year SMALLINT,
     duration_ms INTEGER,
-    popularity INTEGER,
+    popularity UTINYINT,  -- 0-100
     explicit BOOLEAN,
     track_number INTEGER,
     disc_number INTEGER,